@@ -1,16 +1,12 @@
 
 import os
-from pymongo import MongoClient
 import sys
 
-# Load env manually since we are in a simple script
-env_path = ".env"
-if os.path.exists(env_path):
-    with open(env_path, "r") as f:
-        for line in f:
-            if "=" in line and not line.startswith("#"):
-                k, v = line.strip().split("=", 1)
-                os.environ[k] = v.strip('"\'')
+from envloader import load_dotenv
+from mongo_pool import get_client
+
+# Load env
+load_dotenv(".env")
 
 uri = os.getenv("MONGODB_URI")
 db_name = os.getenv("MONGODB_DATABASE")
@@ -20,7 +16,7 @@ if not uri or not db_name:
     sys.exit(1)
 
 try:
-    client = MongoClient(uri)
+    client = get_client(uri)
     db = client[db_name]
     print(f"Connected to {db_name}")
     print("Collections:")
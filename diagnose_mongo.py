@@ -1,17 +1,13 @@
 
 import os
 import sys
-from pymongo import MongoClient
 import json
 
+from envloader import load_dotenv
+from mongo_pool import get_client
+
 # Load env
-env_path = ".env"
-if os.path.exists(env_path):
-    with open(env_path, "r") as f:
-        for line in f:
-            if "=" in line and not line.startswith("#"):
-                k, v = line.strip().split("=", 1)
-                os.environ[k] = v.strip('"\'')
+load_dotenv(".env")
 
 uri = os.getenv("MONGODB_URI")
 db_name = os.getenv("MONGODB_DATABASE")
@@ -23,7 +19,7 @@ if not uri:
     print("No URI")
     sys.exit(1)
 
-client = MongoClient(uri)
+client = get_client(uri)
 db = client[db_name]
 collection = db[col_name]
 
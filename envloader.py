@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Shared minimal .env loader (no extra dependency).
+
+Parsed results are cached per (path, mtime), so repeated calls within one
+process don't re-read or re-parse the file unless it changed on disk.
+"""
+
+import functools
+import os
+from typing import Dict
+
+
+@functools.lru_cache(maxsize=1)
+def _parse(path: str, mtime: float) -> Dict[str, str]:
+    """
+    Parse a .env file into a dict.
+    Supports: KEY=VALUE, quoted values, ignores comments and blank lines.
+    `mtime` is only part of the cache key.
+    """
+    values: Dict[str, str] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                continue
+            if "=" not in line:
+                continue
+            k, v = line.split("=", 1)
+            values[k.strip()] = v.strip().strip('"').strip("'")
+    return values
+
+
+def load_dotenv(path: str = ".env") -> None:
+    """
+    Load KEY=VALUE pairs from `path` into os.environ.
+    Does NOT override already-set environment variables.
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return
+
+    values = _parse(path, mtime)
+    os.environ.update({k: v for k, v in values.items() if k not in os.environ})
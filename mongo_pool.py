@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Shared MongoClient cache.
+
+One client (and its connection pool) is kept per URI for the lifetime of
+the process and closed on interpreter shutdown.
+"""
+
+import atexit
+from typing import Dict
+
+from pymongo import MongoClient
+
+# Pool defaults; options already present in the URI query string win.
+# No minPoolSize: runs are short-lived, and it would have to stay below
+# whatever maxPoolSize the URI sets.
+_POOL_OPTIONS = {
+    "maxPoolSize": 200,
+    "maxIdleTimeMS": 300000,
+}
+
+_CLIENTS: Dict[str, MongoClient] = {}
+
+
+def get_client(uri: str) -> MongoClient:
+    """Return the cached MongoClient for `uri`, creating it on first use."""
+    client = _CLIENTS.get(uri)
+    if client is None:
+        query = uri.partition("?")[2].lower()
+        options = {k: v for k, v in _POOL_OPTIONS.items() if f"{k.lower()}=" not in query}
+        client = MongoClient(uri, serverSelectionTimeoutMS=5000, **options)
+        _CLIENTS[uri] = client
+    return client
+
+
+@atexit.register
+def _close_clients() -> None:
+    for client in _CLIENTS.values():
+        client.close()
+    _CLIENTS.clear()
@@ -1,32 +1,22 @@
 #!/usr/bin/env python3
 import os
+import json
 import time
 import random
-from typing import Any, Dict, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlencode
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from envloader import load_dotenv
 
-def load_dotenv(path: str = ".env") -> None:
-    """
-    Minimal .env loader (no extra dependency).
-    Supports: KEY=VALUE, quoted values, ignores comments and blank lines.
-    Does NOT override already-set environment variables.
-    """
-    if not os.path.exists(path):
-        return
-
-    with open(path, "r", encoding="utf-8") as f:
-        for raw in f:
-            line = raw.strip()
-            if not line or line.startswith("#"):
-                continue
-            if "=" not in line:
-                continue
-            k, v = line.split("=", 1)
-            k = k.strip()
-            v = v.strip().strip('"').strip("'")
-            os.environ.setdefault(k, v)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 
 def getenv(name: str, default: Optional[str] = None) -> str:
@@ -56,6 +46,30 @@ def n8n_headers(api_key: str) -> Dict[str, str]:
     }
 
 
+def dumps_json(obj: Any) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+# Body for the empty-JSON retry fallback
+EMPTY_JSON_BODY = b"{}"
+
+
+def parse_json_response(resp: requests.Response) -> Any:
+    # orjson parses straight from bytes and is faster on large pages
+    if ORJSON_AVAILABLE:
+        return orjson.loads(resp.content)
+    return resp.json()
+
+
+# Upper bound for the retry backoff (exponential part and Retry-After)
+BACKOFF_CAP_SECONDS = 30.0
+
+# Transient HTTP statuses worth retrying
+RETRYABLE_STATUS_CODES = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+
 def request_with_retry(
     session: requests.Session,
     method: str,
@@ -64,66 +78,109 @@ def request_with_retry(
     timeout: int,
     json_body: Any = None,
     max_retries: int = 5,
+    data: Optional[bytes] = None,
 ) -> requests.Response:
     for attempt in range(1, max_retries + 1):
+        resp = None
         try:
-            resp = session.request(method, url, headers=headers, json=json_body, timeout=timeout)
-            # retry on transient problems
-            if resp.status_code in (429, 500, 502, 503, 504):
-                raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:200]}")
-            return resp
-        except Exception as e:
+            resp = session.request(method, url, headers=headers, json=json_body, data=data, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            # Network-level failures are recoverable; anything else is raised as-is
             if attempt == max_retries:
                 raise
-            backoff = (2 ** (attempt - 1)) * 0.6 + random.random() * 0.3
-            print(f"[retry] {method} {url} attempt {attempt}/{max_retries} failed: {e}. sleep {backoff:.2f}s")
-            time.sleep(backoff)
+            error: Any = e
+        else:
+            # retry on transient problems; other statuses (incl. 4xx config errors) return at once
+            if resp.status_code not in RETRYABLE_STATUS_CODES:
+                return resp
+            error = f"HTTP {resp.status_code}: {resp.text[:200]}"
+            if attempt == max_retries:
+                raise RuntimeError(error)
+
+        # Full jitter: spread parallel retries over [0, capped exponential]
+        backoff = random.uniform(0, min(BACKOFF_CAP_SECONDS, 2 ** attempt))
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+        if retry_after:
+            try:
+                # Capped so a huge Retry-After can't stall the run (cron starts new ones)
+                backoff = max(backoff, min(float(retry_after), BACKOFF_CAP_SECONDS))
+            except ValueError:
+                pass  # HTTP-date form is not worth parsing here
+        print(f"[retry] {method} {url} attempt {attempt}/{max_retries} failed: {error}. sleep {backoff:.2f}s")
+        time.sleep(backoff)
     raise RuntimeError("unreachable")
 
 
-def list_failed_executions(
+def _fetch_failed_page(
     session: requests.Session,
-    base_url: str,
-    api_prefix: str,
+    url: str,
     headers: Dict[str, str],
     workflow_id: str,
-    limit: int,
+    cursor: Optional[str],
     timeout: int,
-) -> List[Dict[str, Any]]:
+) -> Tuple[List[str], Optional[str]]:
     """
-    Uses: GET /executions?status=error&workflowId=...&limit=...
-    n8n API supports cursor pagination (nextCursor) in many setups.
+    Fetch one page and reduce it to (execution ids, next cursor).
+    Callers only need the ids, so the rest of the page is dropped here
+    (in the prefetch thread) instead of being carried to the consumer.
     """
-    out: List[Dict[str, Any]] = []
-    cursor: Optional[str] = None
+    if cursor:
+        url += f"&cursor={quote(cursor)}"
 
-    while True:
-        params = {
-            "status": "error",
-            "workflowId": workflow_id,
-            "limit": str(limit),
-            "includeData": "false",
-        }
-        # Build query string
-        q = "&".join([f"{k}={requests.utils.quote(v)}" for k, v in params.items()])
-        if cursor:
-            q += f"&cursor={requests.utils.quote(cursor)}"
+    resp = request_with_retry(session, "GET", url, headers=headers, timeout=timeout)
 
-        url = f"{base_url.rstrip('/')}{api_prefix}/executions?{q}"
-        resp = request_with_retry(session, "GET", url, headers=headers, timeout=timeout)
+    if resp.status_code != 200:
+        raise RuntimeError(f"List executions failed ({workflow_id}): {resp.status_code} {resp.text}")
 
-        if resp.status_code != 200:
-            raise RuntimeError(f"List executions failed ({workflow_id}): {resp.status_code} {resp.text}")
+    data = parse_json_response(resp)
+    batch = data.get("data") or data.get("executions") or []
+    ids = [str(e.get("id") or e.get("executionId") or "") for e in batch]
+    next_cursor = (data.get("nextCursor") or None) if batch else None
+    return [x for x in ids if x], next_cursor
 
-        data = resp.json()
-        batch = data.get("data") or data.get("executions") or []
-        out.extend(batch)
 
-        cursor = data.get("nextCursor") or None
-        if not cursor or not batch:
-            break
-
-    return out
+def iter_failed_executions(
+    session: requests.Session,
+    base_url: str,
+    api_prefix: str,
+    headers: Dict[str, str],
+    workflow_id: str,
+    limit: int,
+    timeout: int,
+) -> Iterator[str]:
+    """
+    Yield ids of failed executions.
+    Uses: GET /executions?status=error&workflowId=...&limit=...
+    n8n API supports cursor pagination (nextCursor) in many setups.
+    The next page is fetched in the background while the caller consumes
+    the current one.
+    """
+    # Build the static query string once; only the cursor changes per page
+    base_q = urlencode({
+        "status": "error",
+        "workflowId": workflow_id,
+        "limit": str(limit),
+        "includeData": "false",
+    }, quote_via=quote)
+    url = f"{base_url.rstrip('/')}{api_prefix}/executions?{base_q}"
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        future: Optional[Future] = pool.submit(
+            _fetch_failed_page, session, url, headers, workflow_id, None, timeout
+        )
+        while future is not None:
+            ids, cursor = future.result()
+
+            future = None
+            if cursor:
+                future = pool.submit(
+                    _fetch_failed_page, session, url, headers, workflow_id, cursor, timeout
+                )
+
+            yield from ids
+    finally:
+        pool.shutdown(wait=False)
 
 
 def retry_execution(
@@ -132,7 +189,7 @@ def retry_execution(
     api_prefix: str,
     headers: Dict[str, str],
     execution_id: str,
-    load_workflow: bool,
+    retry_body: bytes,
     timeout: int,
 ) -> bool:
     """
@@ -140,16 +197,16 @@ def retry_execution(
       POST /api/v1/executions/{id}/retry
     We try with JSON body {loadWorkflow: true|false}. If your instance ignores it,
     it should still work (we fallback to empty body).
+    `retry_body` is that JSON, pre-serialized once per run (see main).
     """
     url = f"{base_url.rstrip('/')}{api_prefix}/executions/{execution_id}/retry"
 
     # Try with body first (commonly used by auto-retry templates)
-    body = {"loadWorkflow": load_workflow}
-    resp = request_with_retry(session, "POST", url, headers=headers, json_body=body, timeout=timeout)
+    resp = request_with_retry(session, "POST", url, headers=headers, data=retry_body, timeout=timeout)
 
     # If some instances reject body format, fallback once with empty JSON
     if resp.status_code in (400, 404, 422):
-        resp2 = request_with_retry(session, "POST", url, headers=headers, json_body={}, timeout=timeout)
+        resp2 = request_with_retry(session, "POST", url, headers=headers, data=EMPTY_JSON_BODY, timeout=timeout)
         return 200 <= resp2.status_code < 300
 
     return 200 <= resp.status_code < 300
@@ -164,11 +221,12 @@ def run_for_workflow(
     workflow_label: str,
     limit: int,
     max_exec: int,
-    load_workflow: bool,
+    retry_body: bytes,
     timeout: int,
     sleep_ms: int,
+    max_workers: int,
 ) -> None:
-    executions = list_failed_executions(
+    exec_ids = iter_failed_executions(
         session=session,
         base_url=base_url,
         api_prefix=api_prefix,
@@ -178,44 +236,51 @@ def run_for_workflow(
         timeout=timeout,
     )
 
-    print(f"\n[info] {workflow_label} ({workflow_id}): found {len(executions)} failed executions")
+    print(f"\n[info] {workflow_label} ({workflow_id}): scanning failed executions")
 
-    tried = 0
     ok = 0
     fail = 0
 
-    for e in executions:
-        if max_exec and tried >= max_exec:
-            break
-
-        exec_id = str(e.get("id") or e.get("executionId") or "")
-        if not exec_id:
-            continue
+    # Retries run in parallel over the shared session and are dispatched as
+    # pages arrive; sleep_ms only spaces out how fast new retries are
+    # dispatched (simple rate limit).
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        found = 0
+        for exec_id in exec_ids:
+            found += 1
+            if max_exec and len(futures) >= max_exec:
+                continue
 
-        tried += 1
-        try:
-            success = retry_execution(
+            futures[pool.submit(
+                retry_execution,
                 session=session,
                 base_url=base_url,
                 api_prefix=api_prefix,
                 headers=headers,
                 execution_id=exec_id,
-                load_workflow=load_workflow,
+                retry_body=retry_body,
                 timeout=timeout,
-            )
-            if success:
-                ok += 1
-                print(f"[ok] retried execution {exec_id}")
-            else:
+            )] = exec_id
+            if sleep_ms:
+                time.sleep(sleep_ms / 1000.0)
+
+        tried = len(futures)
+        print(f"[info] {workflow_label} ({workflow_id}): found {found} failed executions")
+
+        for fut in as_completed(futures):
+            exec_id = futures[fut]
+            try:
+                if fut.result():
+                    ok += 1
+                    print(f"[ok] retried execution {exec_id}")
+                else:
+                    fail += 1
+                    print(f"[fail] could not retry execution {exec_id}")
+
+            except Exception as ex:
                 fail += 1
-                print(f"[fail] could not retry execution {exec_id}")
-
-        except Exception as ex:
-            fail += 1
-            print(f"[error] execution {exec_id}: {ex}")
-
-        if sleep_ms:
-            time.sleep(sleep_ms / 1000.0)
+                print(f"[error] execution {exec_id}: {ex}")
 
     print(f"[summary] {workflow_label}: tried={tried} ok={ok} fail={fail}")
 
@@ -236,9 +301,19 @@ def main() -> None:
     timeout = getenv_int("REQUEST_TIMEOUT", 30)
     sleep_ms = getenv_int("SLEEP_BETWEEN_RETRIES_MS", 150)
     load_workflow = getenv_bool("LOAD_WORKFLOW", True)
+    max_workers = max(1, getenv_int("RETRY_WORKERS", 8))
+
+    # Constant for the whole run, so serialize it once
+    retry_body = dumps_json({"loadWorkflow": load_workflow})
 
-    session = requests.Session()
     headers = n8n_headers(api_key)
+    session = requests.Session()
+    # Keep-alive pool for the n8n host, at least as large as the worker count
+    # so threads don't wait on it
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(32, max_workers))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(headers)
 
     run_for_workflow(
         session=session,
@@ -249,9 +324,10 @@ def main() -> None:
         workflow_label="WEBHOOK",
         limit=limit,
         max_exec=max_exec,
-        load_workflow=load_workflow,
+        retry_body=retry_body,
         timeout=timeout,
         sleep_ms=sleep_ms,
+        max_workers=max_workers,
     )
 
     run_for_workflow(
@@ -263,9 +339,10 @@ def main() -> None:
         workflow_label="WHATSAPP",
         limit=limit,
         max_exec=max_exec,
-        load_workflow=load_workflow,
+        retry_body=retry_body,
         timeout=timeout,
         sleep_ms=sleep_ms,
+        max_workers=max_workers,
     )
 
 
@@ -27,11 +27,20 @@ import os
 import sys
 import json
 import argparse
+import functools
+import heapq
 import time
 import random
+from collections import defaultdict
+from operator import itemgetter
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlencode
 import requests
+from requests.adapters import HTTPAdapter
+
+from envloader import load_dotenv
 
 try:
     from pymongo import MongoClient, UpdateOne
@@ -40,6 +49,16 @@ try:
 except ImportError:
     MONGODB_AVAILABLE = False
 
+if MONGODB_AVAILABLE:
+    from mongo_pool import get_client
+
+# Optional faster JSON parsing/serialization (large execution payloads)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # Timezone configuration - Asia/Riyadh (UTC+3)
 try:
     from zoneinfo import ZoneInfo
@@ -53,28 +72,6 @@ except ImportError:
 # Environment & Configuration Helpers
 # ============================================================================
 
-def load_dotenv(path: str = ".env") -> None:
-    """
-    Minimal .env loader (no extra dependency).
-    Supports: KEY=VALUE, quoted values, ignores comments and blank lines.
-    Does NOT override already-set environment variables.
-    """
-    if not os.path.exists(path):
-        return
-
-    with open(path, "r", encoding="utf-8") as f:
-        for raw in f:
-            line = raw.strip()
-            if not line or line.startswith("#"):
-                continue
-            if "=" not in line:
-                continue
-            k, v = line.split("=", 1)
-            k = k.strip()
-            v = v.strip().strip('"').strip("'")
-            os.environ.setdefault(k, v)
-
-
 def getenv(name: str, default: Optional[str] = None) -> str:
     v = os.getenv(name, default)
     if v is None or v == "":
@@ -114,6 +111,33 @@ def get_auth_headers(api_key: Optional[str], basic_user: Optional[str], basic_pa
     return headers
 
 
+def parse_json_response(resp: requests.Response) -> Any:
+    """Parse a JSON response body, using orjson when installed."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(resp.content)
+    return resp.json()
+
+
+def make_session(headers: Dict[str, str]) -> requests.Session:
+    """
+    Create a session with a keep-alive connection pool for the n8n host.
+    Default headers are set once so per-request headers only merge.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(headers)
+    return session
+
+
+# Upper bound for the retry backoff (exponential part and Retry-After)
+BACKOFF_CAP_SECONDS = 30.0
+
+# Transient HTTP statuses worth retrying
+RETRYABLE_STATUS_CODES = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+
 def request_with_retry(
     session: requests.Session,
     method: str,
@@ -125,18 +149,33 @@ def request_with_retry(
 ) -> requests.Response:
     """Make HTTP request with exponential backoff retry on transient errors."""
     for attempt in range(1, max_retries + 1):
+        resp = None
         try:
             resp = session.request(method, url, headers=headers, json=json_body, timeout=timeout)
-            # Retry on transient problems
-            if resp.status_code in (429, 500, 502, 503, 504):
-                raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:200]}")
-            return resp
-        except Exception as e:
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            # Network-level failures are recoverable; anything else is raised as-is
             if attempt == max_retries:
                 raise
-            backoff = (2 ** (attempt - 1)) * 0.6 + random.random() * 0.3
-            print(f"[retry] {method} {url} attempt {attempt}/{max_retries} failed: {e}. sleep {backoff:.2f}s", file=sys.stderr)
-            time.sleep(backoff)
+            error: Any = e
+        else:
+            # Retry on transient problems; other statuses (incl. 4xx config errors) return at once
+            if resp.status_code not in RETRYABLE_STATUS_CODES:
+                return resp
+            error = f"HTTP {resp.status_code}: {resp.text[:200]}"
+            if attempt == max_retries:
+                raise RuntimeError(error)
+
+        # Full jitter: spread parallel retries over [0, capped exponential]
+        backoff = random.uniform(0, min(BACKOFF_CAP_SECONDS, 2 ** attempt))
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+        if retry_after:
+            try:
+                # Capped so a huge Retry-After can't stall the run (cron starts new ones)
+                backoff = max(backoff, min(float(retry_after), BACKOFF_CAP_SECONDS))
+            except ValueError:
+                pass  # HTTP-date form is not worth parsing here
+        print(f"[retry] {method} {url} attempt {attempt}/{max_retries} failed: {error}. sleep {backoff:.2f}s", file=sys.stderr)
+        time.sleep(backoff)
     raise RuntimeError("unreachable")
 
 
@@ -144,14 +183,19 @@ def request_with_retry(
 # MongoDB Helpers
 # ============================================================================
 
+# Ops per bulk_write call and how many chunks are written concurrently
+BULK_WRITE_CHUNK_SIZE = 1000
+BULK_WRITE_WORKERS = 4
+
+
 def get_mongodb_client(uri: str) -> Optional[MongoClient]:
-    """Create MongoDB client."""
+    """Get the shared (pooled) MongoDB client for this URI."""
     if not MONGODB_AVAILABLE:
         print("[warn] pymongo not installed, MongoDB features disabled", file=sys.stderr)
         return None
     
     try:
-        client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+        client = get_client(uri)
         # Test connection
         client.admin.command('ping')
         return client
@@ -165,22 +209,59 @@ def deduplicate_history(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     Remove duplicate status entries from history.
     Duplicates are identified by status, timestamp, and executionId.
     """
-    seen = set()
-    deduplicated = []
-    
+    # dict keeps insertion order, so the first occurrence of each key wins
+    seen: Dict[Tuple[Any, Any, Any], Dict[str, Any]] = {}
     for item in history:
-        # Create unique key
-        unique_key = (
-            item.get("status"),
-            item.get("timestamp"),
-            item.get("executionId"),
-        )
-        
-        if unique_key not in seen:
-            seen.add(unique_key)
-            deduplicated.append(item)
+        seen.setdefault((item.get("status"), item.get("timestamp"), item.get("executionId")), item)
+    
+    return list(seen.values())
+
+
+def build_status_update(msg: Dict[str, Any], now: datetime) -> List[Dict[str, Any]]:
+    """
+    Build an aggregation-pipeline update (MongoDB 4.2+) for one message.
+    
+    The server keeps the stored status fields when they are newer than the
+    scanned ones (e.g. the execution that carried them is no longer in the
+    scan window), so no client-side read is needed to decide.
+    Scanned values are wrapped in $literal so strings starting with "$"
+    are never treated as field paths.
+    """
+    is_newer = {"$gte": [{"$literal": msg.get("latestTimestamp") or 0}, {"$ifNull": ["$latestTimestamp", 0]}]}
+    
+    def if_newer(field: str, value: Any) -> Dict[str, Any]:
+        return {"$cond": [is_newer, {"$literal": value}, f"${field}"]}
+    
+    return [
+        {"$set": {
+            "latestStatus": if_newer("latestStatus", msg.get("latestStatus")),
+            "latestTimestamp": if_newer("latestTimestamp", msg.get("latestTimestamp")),
+            "latestTimestampFormatted": if_newer("latestTimestampFormatted", msg.get("latestTimestampFormatted")),
+            "statusCount": if_newer("statusCount", msg.get("statusCount", 0)),
+            "statusHistory": if_newer("statusHistory", msg.get("history", [])),
+            "lastScannedAt": {"$literal": now},
+        }},
+        {"$set": {"firstSeenAt": {"$ifNull": ["$firstSeenAt", {"$literal": now}]}}},
+    ]
+
+
+def bulk_write_chunked(collection: Any, updates: List[Any]) -> Tuple[int, int]:
+    """
+    Run unordered bulk writes in fixed-size chunks, a few in parallel.
+    Returns (matched_count, modified_count) summed over all chunks.
+    """
+    chunks = [updates[i:i + BULK_WRITE_CHUNK_SIZE] for i in range(0, len(updates), BULK_WRITE_CHUNK_SIZE)]
+    if len(chunks) == 1:
+        result = collection.bulk_write(chunks[0], ordered=False)
+        return result.matched_count, result.modified_count
     
-    return deduplicated
+    matched_count = 0
+    modified_count = 0
+    with ThreadPoolExecutor(max_workers=BULK_WRITE_WORKERS) as pool:
+        for result in pool.map(lambda chunk: collection.bulk_write(chunk, ordered=False), chunks):
+            matched_count += result.matched_count
+            modified_count += result.modified_count
+    return matched_count, modified_count
 
 
 def save_messages_to_mongodb(
@@ -208,7 +289,9 @@ def save_messages_to_mongodb(
         
         updates = []
         updated_count = 0
-        now = datetime.now(RIYADH_TZ)
+        # One UTC timestamp shared by every update and chunk; BSON dates are
+        # stored as UTC anyway (convert with .astimezone(RIYADH_TZ) on read)
+        now = datetime.now(timezone.utc)
         
         # print(f"[debug] Processing {len(messages)} potential updates...", file=sys.stderr)
         
@@ -229,17 +312,8 @@ def save_messages_to_mongodb(
             if len(updates) < 3:
                 print(f"[debug] Preparing update for message_id='{message_id}' (wa_id='{wa_id}')", file=sys.stderr)
             
-            # Update specific fields
-            update_doc = {
-                "$set": {
-                    "latestStatus": msg.get("latestStatus"),
-                    "latestTimestamp": msg.get("latestTimestamp"),
-                    "latestTimestampFormatted": msg.get("latestTimestampFormatted"),
-                    "statusCount": msg.get("statusCount", 0),
-                    "statusHistory": msg.get("history", []),
-                    "lastScannedAt": now,
-                }
-            }
+            # Update specific fields (server-side guarded, see build_status_update)
+            update_doc = build_status_update(msg, now)
             
             # Execute one by one to give specific feedback per ID (slower but deeper debug)
             # Or continue using bulk_write but we won't get per-item feedback easily on matches if matched=0.
@@ -259,9 +333,10 @@ def save_messages_to_mongodb(
         
         if updates:
             # print(f"[debug] Executing {len(updates)} updates on collection '{collection_name}'", file=sys.stderr)
-            result = collection.bulk_write(updates, ordered=False)
-            print(f"[summary] Processed {len(messages)} messages -> Updated {result.modified_count} docs in MongoDB.", file=sys.stderr)
-            return result.modified_count
+            matched_count, modified_count = bulk_write_chunked(collection, updates)
+            missing_count = len(updates) - matched_count
+            print(f"[summary] Processed {len(messages)} messages -> Updated {modified_count} docs in MongoDB ({missing_count} not found).", file=sys.stderr)
+            return modified_count
         
         print(f"[summary] Processed {len(messages)} messages -> No updates needed.", file=sys.stderr)
         return 0
@@ -272,8 +347,6 @@ def save_messages_to_mongodb(
     except Exception as e:
         print(f"[mongodb] Error saving to MongoDB: {e}", file=sys.stderr)
         return 0
-    finally:
-        client.close()
 
 
 
@@ -281,54 +354,109 @@ def save_messages_to_mongodb(
 # n8n API Functions
 # ============================================================================
 
-def fetch_executions(
+def _fetch_executions_page(
     session: requests.Session,
-    base_url: str,
-    api_prefix: str,
+    url_base: str,
     headers: Dict[str, str],
     workflow_id: str,
-    limit: int,
+    batch_limit: int,
+    cursor: Optional[str],
     timeout: int,
-) -> List[Dict[str, Any]]:
+) -> Dict[str, Any]:
     """
-    Fetch executions for a workflow from n8n API with pagination support.
-    Returns list of execution objects (most recent first).
-    
-    Uses: GET /executions?workflowId=...&limit=...&includeData=true
+    Fetch and parse a single page of executions.
+    `url_base` already carries the static, pre-encoded query string.
     """
-    out: List[Dict[str, Any]] = []
-    cursor: Optional[str] = None
-    fetched = 0
+    url = f"{url_base}&limit={batch_limit}"
+    if cursor:
+        url += f"&cursor={quote(cursor)}"
 
-    while fetched < limit:
-        batch_limit = min(100, limit - fetched)  # n8n often caps at 100 per request
-        
-        params = {
-            "workflowId": workflow_id,
-            "limit": str(batch_limit),
-            "includeData": "true",  # CRITICAL: we need execution data to scan
-        }
-        
-        q = "&".join([f"{k}={requests.utils.quote(v)}" for k, v in params.items()])
-        if cursor:
-            q += f"&cursor={requests.utils.quote(cursor)}"
+    resp = request_with_retry(session, "GET", url, headers=headers, timeout=timeout)
 
-        url = f"{base_url.rstrip('/')}{api_prefix}/executions?{q}"
-        resp = request_with_retry(session, "GET", url, headers=headers, timeout=timeout)
+    if resp.status_code != 200:
+        raise RuntimeError(f"List executions failed ({workflow_id}): {resp.status_code} {resp.text}")
 
-        if resp.status_code != 200:
-            raise RuntimeError(f"List executions failed ({workflow_id}): {resp.status_code} {resp.text}")
+    return parse_json_response(resp)
 
-        data = resp.json()
-        batch = data.get("data") or data.get("executions") or []
-        out.extend(batch)
-        fetched += len(batch)
 
-        cursor = data.get("nextCursor") or None
-        if not cursor or not batch:
-            break
-
-    return out[:limit]  # Ensure we don't exceed requested limit
+def iter_executions(
+    session: requests.Session,
+    base_url: str,
+    api_prefix: str,
+    headers: Dict[str, str],
+    workflow_id: str,
+    limit: int,
+    timeout: int,
+    prefetch: bool = True,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield executions for a workflow from n8n API with pagination support
+    (most recent first), at most `limit` in total.
+    
+    With `prefetch`, the next page is requested in the background as soon
+    as the current page's cursor is known, so network time overlaps with
+    the caller's processing of the current page. Without it, the next page
+    is only requested once the current one has been consumed, so a caller
+    that stops early never downloads a page it won't use. Stopping
+    iteration early skips any remaining pages. Only the yielded execution,
+    the rest of the current page and the prefetched page are held in
+    memory at a time.
+    
+    Uses: GET /executions?workflowId=...&limit=...&includeData=true
+    """
+    if limit <= 0:
+        return
+    
+    # Static part of the query string is encoded once for all pages
+    base_q = urlencode({
+        "workflowId": workflow_id,
+        "includeData": "true",  # CRITICAL: we need execution data to scan
+    }, quote_via=quote)
+    url_base = f"{base_url.rstrip('/')}{api_prefix}/executions?{base_q}"
+    
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        fetched = 0
+        future: Optional[Future] = pool.submit(
+            _fetch_executions_page,
+            session, url_base, headers, workflow_id,
+            min(100, limit),  # n8n often caps at 100 per request
+            None, timeout,
+        )
+        while future is not None:
+            data = future.result()
+            batch = data.get("data") or data.get("executions") or []
+            cursor = data.get("nextCursor") or None
+            del data  # keep only the executions list alive, not the page dict
+            del batch[limit - fetched:]
+            fetched += len(batch)
+
+            future = None
+            next_page = None
+            if cursor and batch and fetched < limit:
+                next_page = (min(100, limit - fetched), cursor)
+                if prefetch:
+                    future = pool.submit(
+                        _fetch_executions_page,
+                        session, url_base, headers, workflow_id,
+                        *next_page, timeout,
+                    )
+
+            # Hand out executions one at a time, dropping the page's reference
+            # to each, so a scanned execution's runData tree can be freed
+            # before the rest of the page is processed
+            batch.reverse()
+            while batch:
+                yield batch.pop()
+
+            if next_page and not prefetch:
+                future = pool.submit(
+                    _fetch_executions_page,
+                    session, url_base, headers, workflow_id,
+                    *next_page, timeout,
+                )
+    finally:
+        pool.shutdown(wait=False)
 
 
 # ============================================================================
@@ -337,16 +465,28 @@ def fetch_executions(
 
 def normalize_timestamp(ts: Any) -> Optional[int]:
     """Convert timestamp to int, handle strings and None."""
-    if ts is None:
+    # int() would truncate floats; they were never accepted
+    if ts is None or type(ts) is float:
+        return None
+    try:
+        return int(ts)
+    except (TypeError, ValueError):
+        return None
+
+
+# Allowed drift between WhatsApp status timestamps and the n8n host clock
+STATUS_CLOCK_SKEW_SECONDS = 60
+
+
+def execution_started_at(execution: Dict[str, Any]) -> Optional[int]:
+    """Parse an execution's ISO `startedAt` into a Unix timestamp (None if missing/invalid)."""
+    started = execution.get("startedAt")
+    if not started or not isinstance(started, str):
+        return None
+    try:
+        return int(datetime.fromisoformat(started.replace("Z", "+00:00")).timestamp())
+    except ValueError:
         return None
-    if isinstance(ts, int):
-        return ts
-    if isinstance(ts, str):
-        try:
-            return int(ts)
-        except ValueError:
-            return None
-    return None
 
 
 def format_timestamp(ts: Optional[int]) -> Optional[str]:
@@ -356,32 +496,25 @@ def format_timestamp(ts: Optional[int]) -> Optional[str]:
     """
     if ts is None:
         return None
+    # Output has minute resolution, so all timestamps within a minute share one cache entry
+    return _format_minute(ts // 60)
+
+
+@functools.lru_cache(maxsize=8192)
+def _format_minute(minute: int) -> Optional[str]:
     try:
-        dt = datetime.fromtimestamp(ts, tz=RIYADH_TZ)
+        dt = datetime.fromtimestamp(minute * 60, tz=RIYADH_TZ)
         return dt.strftime("%Y-%m-%d %H:%M")
-    except (ValueError, OSError):
+    except (ValueError, OSError, OverflowError):
         return None
 
 
 
-def extract_status_updates(
-    execution: Dict[str, Any],
-    message_id: str,
-    wa_id: str,
-) -> List[Dict[str, Any]]:
+def iter_status_objects(execution: Dict[str, Any]) -> Iterator[Tuple[Dict[str, Any], str]]:
     """
-    Extract all status updates matching message_id from an execution.
-    
-    Returns list of:
-    {
-        "status": str,
-        "timestamp": int or None,
-        "recipient_id": str or None,
-        "executionId": str,
-        "recipientMismatch": bool
-    }
+    Yield (status_obj, execution_id) for every WhatsApp status object in an execution.
+    Walks runData -> node runs -> data.main -> items -> json.body.statuses.
     """
-    results = []
     execution_id = str(execution.get("id", "unknown"))
     
     # Execution data can be in different places depending on n8n version
@@ -394,7 +527,7 @@ def extract_status_updates(
     run_data = result_data.get("runData") or {}
     
     # Scan all nodes for status webhooks
-    for node_name, node_runs in run_data.items():
+    for node_runs in run_data.values():
         if not isinstance(node_runs, list):
             continue
             
@@ -403,7 +536,8 @@ def extract_status_updates(
                 continue
                 
             # Check in data.main (typical location for node output)
-            main_data = run.get("data", {}).get("main") or []
+            run_output = run.get("data")
+            main_data = (run_output.get("main") if run_output else None) or []
             
             for main_item in main_data:
                 if not isinstance(main_item, list):
@@ -414,11 +548,14 @@ def extract_status_updates(
                         continue
                     
                     # Look for webhook body structure
-                    body = item.get("json", {}).get("body") or item.get("json", {})
+                    item_json = item.get("json") or {}
+                    body = item_json.get("body") or item_json
                     
                     # Handle both direct body and body[0] format
                     if isinstance(body, list) and len(body) > 0:
                         body = body[0]
+                    if not isinstance(body, dict):
+                        continue
                     
                     # Extract statuses array
                     statuses = body.get("statuses") or []
@@ -426,50 +563,82 @@ def extract_status_updates(
                         continue
                     
                     for status_obj in statuses:
-                        if not isinstance(status_obj, dict):
-                            continue
-                        
-                        # Match message_id
-                        status_msg_id = status_obj.get("id", "")
-                        if status_msg_id != message_id:
-                            continue
-                        
-                        # Extract fields
-                        status = status_obj.get("status", "unknown")
-                        timestamp = normalize_timestamp(status_obj.get("timestamp"))
-                        recipient_id = status_obj.get("recipient_id")
-                        
-                        # Check for wa_id mismatch
-                        recipient_mismatch = False
-                        if recipient_id and recipient_id != wa_id:
-                            recipient_mismatch = True
-                        
-                        results.append({
-                            "status": status,
-                            "timestamp": timestamp,
-                            "timestampFormatted": format_timestamp(timestamp),
-                            "recipient_id": recipient_id,
-                            "executionId": execution_id,
-                            "recipientMismatch": recipient_mismatch,
-                        })
-    
-    return results
+                        if isinstance(status_obj, dict):
+                            yield status_obj, execution_id
 
 
-def get_status_priority(status: str) -> int:
-    """
-    Return priority for status ordering (higher = more important).
-    Terminal states get highest priority.
+def extract_status_updates(
+    execution: Dict[str, Any],
+    message_id: str,
+    wa_id: str,
+    seen: Optional[set] = None,
+) -> List[Dict[str, Any]]:
     """
-    priority_map = {
-        "failed": 100,
-        "undelivered": 100,
-        "read": 50,
-        "delivered": 40,
-        "sent": 30,
-        "unknown": 10,
+    Extract all status updates matching message_id from an execution.
+    
+    If `seen` is given, updates whose (status, timestamp, recipient_id,
+    executionId) key is already in it are skipped, and new keys are added,
+    so duplicates are dropped during collection across executions.
+    
+    Returns list of:
+    {
+        "status": str,
+        "timestamp": int or None,
+        "recipient_id": str or None,
+        "executionId": str,
+        "recipientMismatch": bool
     }
-    return priority_map.get(status.lower(), 10)
+    """
+    results = []
+    
+    for status_obj, execution_id in iter_status_objects(execution):
+        get = status_obj.get
+        
+        # Match message_id
+        status_msg_id = get("id", "")
+        if status_msg_id != message_id:
+            continue
+        
+        # Extract fields
+        status = get("status", "unknown").lower()
+        timestamp = normalize_timestamp(get("timestamp"))
+        recipient_id = get("recipient_id")
+        
+        if seen is not None:
+            unique_key = (status, timestamp, recipient_id, execution_id)
+            if unique_key in seen:
+                continue
+            seen.add(unique_key)
+        
+        # Check for wa_id mismatch
+        recipient_mismatch = False
+        if recipient_id and recipient_id != wa_id:
+            recipient_mismatch = True
+        
+        results.append({
+            "status": status,
+            "timestamp": timestamp,
+            "timestampFormatted": format_timestamp(timestamp),
+            "recipient_id": recipient_id,
+            "executionId": execution_id,
+            "recipientMismatch": recipient_mismatch,
+        })
+    
+    return results
+
+
+# Priority for status ordering (higher = more important).
+# Terminal states get highest priority.
+_PRIORITY_MAP = {
+    "failed": 100,
+    "undelivered": 100,
+    "read": 50,
+    "delivered": 40,
+    "sent": 30,
+    "unknown": 10,
+}
+# Bound lookup for sort keys; statuses are lowercased at extraction time
+_get_prio = _PRIORITY_MAP.get
 
 
 def is_terminal_status(status: str) -> bool:
@@ -502,7 +671,7 @@ def determine_latest_status(history: List[Dict[str, Any]]) -> Tuple[str, Optiona
         valid_history,
         key=lambda x: (
             x.get("timestamp") or 0,  # timestamp descending (0 if None goes to bottom)
-            get_status_priority(x.get("status", "unknown"))
+            _get_prio(x.get("status", "unknown"), 10)
         ),
         reverse=True
     )
@@ -525,6 +694,7 @@ def list_recent_messages(
     max_messages: int = 10,
     since: Optional[int] = None,
     timeout: int = 30,
+    stop_early: bool = True,
 ) -> Dict[str, Any]:
     """
     List recent messages with their statuses.
@@ -533,12 +703,20 @@ def list_recent_messages(
     - wa_id: if provided, only show messages for this user
     - since: if provided, only show messages with timestamps >= since
     
+    With stop_early, scanning stops once max_messages messages are newer
+    than the current execution's start: executions arrive newest first and
+    a status can't be newer than the execution that received it. Like the
+    terminal-status exit in track mode, totalMessages and each history
+    then only cover the executions scanned so far, so callers that store
+    full histories (MongoDB) should pass stop_early=False. Pages are not
+    prefetched in that mode, so a stop doesn't leave a download running.
+    
     Returns list of messages with their latest statuses.
     """
-    session = requests.Session()
+    session = make_session(headers)
     
     # print(f"[info] Fetching up to {limit} executions for workflow {workflow_id}...", file=sys.stderr)
-    executions = fetch_executions(
+    executions = iter_executions(
         session=session,
         base_url=base_url,
         api_prefix=api_prefix,
@@ -546,114 +724,87 @@ def list_recent_messages(
         workflow_id=workflow_id,
         limit=limit,
         timeout=timeout,
+        prefetch=not stop_early,
     )
     # print(f"[info] Retrieved {len(executions)} executions", file=sys.stderr)
     
-    # Collect all status updates from all executions
-    all_statuses = []
+    # Phase 1: flatten matching status updates into plain tuples, grouped by
+    # message_id: (sort_key, recipient_id, status, timestamp, execution_id).
+    # sort_key orders by timestamp, then priority (all priorities are < 256).
+    # Dicts are only built for the messages that are actually returned.
+    messages_map: Dict[str, List[Tuple[int, Any, str, Optional[int], str]]] = defaultdict(list)
+    # Min-heap of the first-seen timestamp of up to max_messages messages;
+    # each is a lower bound on that message's latest timestamp
+    top_ts: List[int] = []
     
     for execution in executions:
         try:
-            execution_id = str(execution.get("id", "unknown"))
-            exec_data = execution.get("data") or execution.get("executionData") or {}
-            result_data = exec_data.get("resultData") or {}
-            run_data = result_data.get("runData") or {}
-            
-            # Scan all nodes for status webhooks
-            for node_name, node_runs in run_data.items():
-                if not isinstance(node_runs, list):
+            for status_obj, execution_id in iter_status_objects(execution):
+                get = status_obj.get
+                msg_id = get("id", "")
+                if not msg_id:
                     continue
-                    
-                for run in node_runs:
-                    if not isinstance(run, dict):
-                        continue
-                        
-                    main_data = run.get("data", {}).get("main") or []
-                    
-                    for main_item in main_data:
-                        if not isinstance(main_item, list):
-                            continue
-                            
-                        for item in main_item:
-                            if not isinstance(item, dict):
-                                continue
-                            
-                            body = item.get("json", {}).get("body") or item.get("json", {})
-                            
-                            if isinstance(body, list) and len(body) > 0:
-                                body = body[0]
-                            
-                            statuses = body.get("statuses") or []
-                            if not isinstance(statuses, list):
-                                continue
-                            
-                            for status_obj in statuses:
-                                if not isinstance(status_obj, dict):
-                                    continue
-                                
-                                msg_id = status_obj.get("id", "")
-                                if not msg_id:
-                                    continue
-                                
-                                status = status_obj.get("status", "unknown")
-                                timestamp = normalize_timestamp(status_obj.get("timestamp"))
-                                recipient_id = status_obj.get("recipient_id")
-                                
-                                # Apply filters
-                                if since and (timestamp or 0) < since:
-                                    continue
-                                
-                                if wa_id and recipient_id and recipient_id != wa_id:
-                                    continue
-                                
-                                all_statuses.append({
-                                    "messageId": msg_id,
-                                    "waId": recipient_id,
-                                    "status": status,
-                                    "timestamp": timestamp,
-                                    "timestampFormatted": format_timestamp(timestamp),
-                                    "executionId": execution_id,
-                                })
+                
+                # Apply filters first so filtered statuses never build a record
+                timestamp = normalize_timestamp(get("timestamp"))
+                if since and (timestamp or 0) < since:
+                    continue
+                
+                recipient_id = get("recipient_id")
+                if wa_id and recipient_id and recipient_id != wa_id:
+                    continue
+                
+                status = get("status", "unknown").lower()
+                if msg_id not in messages_map:
+                    if len(top_ts) < max_messages:
+                        heapq.heappush(top_ts, timestamp or 0)
+                    else:
+                        heapq.heappushpop(top_ts, timestamp or 0)
+                sort_key = ((timestamp or 0) << 8) | _get_prio(status, 10)
+                messages_map[msg_id].append((sort_key, recipient_id, status, timestamp, execution_id))
         except Exception as e:
             print(f"[warn] Error processing execution {execution.get('id')}: {e}", file=sys.stderr)
             continue
-    
-    # Group by message_id and find latest status for each
-    messages_map: Dict[str, List[Dict[str, Any]]] = {}
-    for status in all_statuses:
-        msg_id = status["messageId"]
-        if msg_id not in messages_map:
-            messages_map[msg_id] = []
-        messages_map[msg_id].append(status)
-    
-    # Determine latest status for each message
-    messages = []
-    for msg_id, statuses in messages_map.items():
-        # Sort by timestamp descending, then by priority
-        sorted_statuses = sorted(
-            statuses,
-            key=lambda x: (
-                x.get("timestamp") or 0,
-                get_status_priority(x.get("status", "unknown"))
-            ),
-            reverse=True
-        )
         
-        latest = sorted_statuses[0]
+        # Early exit once older executions can't change the top messages
+        if stop_early and max_messages > 0 and len(top_ts) >= max_messages:
+            started_at = execution_started_at(execution)
+            if started_at is not None and top_ts[0] > started_at + STATUS_CLOCK_SKEW_SECONDS:
+                print(f"[info] Newest {max_messages} message(s) found, stopping scan", file=sys.stderr)
+                break
+    
+    status_key = itemgetter(0)
+    
+    # Phase 2: latest record per message (single pass, no sort), then keep
+    # only the newest max_messages
+    latest = {msg_id: max(records, key=status_key) for msg_id, records in messages_map.items()}
+    top = heapq.nlargest(max_messages, latest.items(), key=lambda kv: kv[1][3] or 0)
+    
+    # Phase 3: build the result dicts, with the full history (newest first;
+    # included for MongoDB), for the returned messages only
+    messages = []
+    for msg_id, (_, recipient_id, status, timestamp, _) in top:
+        records = messages_map[msg_id]
         messages.append({
             "messageId": msg_id,
-            "waId": latest.get("waId"),
-            "latestStatus": latest.get("status"),
-            "latestTimestamp": latest.get("timestamp"),
-            "latestTimestampFormatted": latest.get("timestampFormatted"),
-            "statusCount": len(statuses),
-            "history": sorted_statuses,  # Include full history for MongoDB
+            "waId": recipient_id,
+            "latestStatus": status,
+            "latestTimestamp": timestamp,
+            "latestTimestampFormatted": format_timestamp(timestamp),
+            "statusCount": len(records),
+            "history": [
+                {
+                    "messageId": msg_id,
+                    "waId": rec_recipient_id,
+                    "status": rec_status,
+                    "timestamp": rec_timestamp,
+                    "timestampFormatted": format_timestamp(rec_timestamp),
+                    "executionId": execution_id,
+                }
+                for _, rec_recipient_id, rec_status, rec_timestamp, execution_id in sorted(records, key=status_key, reverse=True)
+            ],
         })
     
-    # Sort by timestamp (newest first) and limit
-    messages.sort(key=lambda x: x.get("latestTimestamp") or 0, reverse=True)
-    messages = messages[:max_messages]
-    
     # print(f"[info] Found {len(messages_map)} unique message(s), showing top {len(messages)}", file=sys.stderr)
     
     return {
@@ -680,11 +831,11 @@ def track_message_status(
     
     Returns result dict with structure defined in requirements.
     """
-    session = requests.Session()
+    session = make_session(headers)
     
     # Fetch executions
     # print(f"[info] Fetching up to {limit} executions for workflow {workflow_id}...", file=sys.stderr)
-    executions = fetch_executions(
+    executions = iter_executions(
         session=session,
         base_url=base_url,
         api_prefix=api_prefix,
@@ -696,12 +847,15 @@ def track_message_status(
     # print(f"[info] Retrieved {len(executions)} executions", file=sys.stderr)
     
     # Scan executions for status updates
+    # (same status can appear multiple times in execution data, so
+    # duplicates are skipped while collecting)
     all_statuses = []
+    seen: set = set()
     found_terminal = False
     
     for execution in executions:
         try:
-            statuses = extract_status_updates(execution, message_id, wa_id)
+            statuses = extract_status_updates(execution, message_id, wa_id, seen)
             
             # Apply since filter
             if since:
@@ -725,26 +879,6 @@ def track_message_status(
             print(f"[warn] Error processing execution {execution.get('id')}: {e}", file=sys.stderr)
             continue
     
-    # Deduplicate statuses (same status can appear multiple times in execution data)
-    seen = set()
-    deduplicated_statuses = []
-    
-    for status in all_statuses:
-        # Create unique key from all fields
-        unique_key = (
-            status.get("status"),
-            status.get("timestamp"),
-            status.get("recipient_id"),
-            status.get("executionId"),
-        )
-        
-        if unique_key not in seen:
-            seen.add(unique_key)
-            deduplicated_statuses.append(status)
-    
-    # print(f"[info] Deduplicated {len(all_statuses) - len(deduplicated_statuses)} duplicate status entries", file=sys.stderr)
-    all_statuses = deduplicated_statuses
-    
     # Sort history by timestamp descending
     all_statuses.sort(key=lambda x: x.get("timestamp") or 0, reverse=True)
     
@@ -813,6 +947,8 @@ def main() -> None:
             limit=args.limit,
             max_messages=args.max_messages,
             since=args.since,
+            # Stored histories must not be replaced with truncated ones
+            stop_early=not args.save_to_mongodb,
         )
         
         # Save to MongoDB if requested
@@ -862,7 +998,11 @@ def main() -> None:
     
     # Output JSON (machine-readable only to stdout)
     if args.json:
-        print(json.dumps(result, indent=2, ensure_ascii=False))
+        if ORJSON_AVAILABLE:
+            sys.stdout.flush()
+            sys.stdout.buffer.write(orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS) + b"\n")
+        else:
+            print(json.dumps(result, indent=2, ensure_ascii=False))
 
 
 if __name__ == "__main__":